@@ -7,11 +7,17 @@
 # The problem now is that "AIS-07" is a key in more than one row in the metrics.csv
 # When read, an error is returned.
 
-import csv
+import argparse
+import glob
+import json
 import os
+import tempfile
+import unittest
 from datetime import datetime 
 from datetime import timezone
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import pandas as pd  # after pip install pandas
 # from csv import DictReader
 
@@ -20,6 +26,11 @@ import pandas as pd  # after pip install pandas
 package="pandas"
 import subprocess
 import sys
+
+# snapshot_cache.py is in the folder above this one:
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import snapshot_cache
+
 def install(package):
     subprocess.check_call([sys.executable, "-m", "pip", "install", package])
 
@@ -39,7 +50,9 @@ local_tzname = local_tz.tzname(local_now)
 # User selections: TODO: choose in parameters within a GUI:
 bool_output_console=True
 bool_output_file=True
-bool_output_table=False
+output_format="markdown"   # or "html" (one table) or "json", all from the same document records.
+bool_stream_chunks=False   # True to merge-join both csv files in chunks (must be sorted by CCM ID).
+stream_chunk_rows=5000     # rows per chunk read from each csv file in streaming mode.
 
 print_category_list=False
 bool_print_categories=True
@@ -60,19 +73,12 @@ file_subject_text="for Consul users' auditors"
 caiq_file_to_open='CAIQ4.0.1.consul.csv'
 metrics_file_to_open='metrics.csv'
 
+output_file_extensions = {"markdown": ".md", "html": ".html", "json": ".json"}
 #output_file_date=str(local_dt)[0:10]
 output_file_date="2022-08-09"
 output_file_prefix="CAIQ4.0.1.consul"
-output_file_name=output_file_date+"-"+output_file_prefix+".md"  # Like 2021-05-12-caiq-yaml-gen.md
+output_file_name=output_file_date+"-"+output_file_prefix+output_file_extensions[output_format]  # Like 2021-05-12-caiq-yaml-gen.md
     # See https://courses.cs.washington.edu/courses/cse140/13wi/csv-parsing.html
-# Validate run parameters:
-output_file_delete_if_exists=True
-# To avoid io.UnsupportedOperation: not writable, first verify if file exists
-if os.path.exists(output_file_name) :
-    print(f'*** file {output_file_name} being removed for rewrite ...')
-    # No Prompt so this can run silent.
-    os.remove(output_file_name)      
-f = open(output_file_name, "a")
 
 # Show what setting were selected for this run:
 run_stats_line=""
@@ -94,24 +100,6 @@ if print_answers == True :
 category_format="###"  # "bold" or "Not"
 
 
-# Output yaml heading:
-if bool_output_console == True :
-    print("*** "+ str(local_dt) +" "+ local_tzname +"\r\n")
-    print("*** "+ run_stats_line +"\r\n")
-if bool_output_file == True :
-    f.write("---" +"\r\n")
-    f.write("layout: post" +"\r\n")
-    f.write("date: \""+ output_file_date +"\"\r\n")
-    f.write("file: \""+ output_file_prefix  +"\"\r\n")
-    f.write("title: \"CAIQ (Consensus Assessment Initiative Questionnaire) " + file_subject_text +".\"\r\n")
-    f.write("excerpt: \""+ run_stats_line +" generated from file "+ caiq_file_to_open +" by "+ this_program_name +"\"\r\n")
-    f.write("tags: [cloud, security, management, audit]" +"\r\n")
-    f.write("---" +"\r\n")
-
-#    f.write("\r\n")
-#    f.write("<!-- At https://github.com/bomonike/fullest-stack/blob/main/python/caiq-yaml-gen/ -->\r\n")
-#    f.write("\r\n")
-
 # Output Category summary:
 caiq_categories = {
     'A&A': 'Audit Assurance & Compliance',
@@ -133,244 +121,627 @@ caiq_categories = {
     'UEM': 'Universal Endpoint Management'
     }
     # TODO: UEM DEFINITION: Unified Endpoint Management (UEM) allows IT to manage, secure, and deploy corporate resources and applications on any device from a single console. UEM “unifies” legacy mobile device management (MDM) by incorporating IoT and other new device technologies.
-if print_category_list == True :
-    f.write("## Categories in the CAIQ : \r\n")
-    f.write("\r\n")
 
-    for key, value in caiq_categories.items():
-        print_line="1. <a href=\"#"+ key +"-\"><tt>"+ key +"</tt></a> = "+ value
-        if bool_output_console == True :
-            print(f'{print_line}')
-        if bool_output_file == True :
-            f.write(f'{print_line} \r\n')
-    if bool_output_console == True :
-        print("\r\n---------")
-    if bool_output_file == True :
-        f.write("\r\n<hr />\r\n")
 
+def prepare_caiq_frame(caiq, prev_title=""):
+    """Add the derived columns the join and renderers use.
+       prev_title carries the last title over from the previous chunk when streaming.
+    """
+    # Rest of lines: Get first 3 characters of _QID for Categories:
+    caiq["_Category"] = caiq["_QID"].str[0:3]   # such as "A&A"
+    caiq["_CCM_ID"] = caiq["_QID"].str[0:6]     # such as "A&A-01" to lookup metric
+    # If no title, get from previous row:
+    caiq["_Title_Filled"] = caiq["_Title"].mask(caiq["_Title"] == "").ffill().fillna(prev_title)
+    return caiq
+
+
+def read_caiq_frame(caiq_file):
+    """Read the CAIQ csv as text columns (utf-8-sig drops the BOM before ID).
+       Opened in text mode so multi-line questions get \\n line ends, as csv.DictReader gave.
+    """
+    with open(caiq_file, mode='r', encoding="utf-8-sig") as csv_file:
+        return prepare_caiq_frame(pd.read_csv(csv_file, dtype=str, keep_default_na=False))
+
+
+def metric_records_column(metrics):
+    """Return a list with one metric record (dict) per row of the metrics frame."""
+    m = metrics.fillna("")
+    return pd.DataFrame({
+        "metric_id": m["_Metric_ID"].astype(str),
+        "slo": m["_SLO"].astype(str),
+        "title": m["_Metric_Title"].astype(str),
+        "desc": m["_Metric_Desc"].astype(str),
+        "note": m["_Note1"].astype(str),
+        }).to_dict("records")
+
+
+def metric_records_by_ccm_id(metrics):
+    """Return a Series of lists of metric records (dicts), indexed by _CCM_ID.
+       Any number of metrics per CCM ID (AIS-07 has M3 and M6) lands in one list.
+    """
+    m = metrics.reset_index()
+    m["_Metric"] = metric_records_column(m)
+    return m.groupby("_CCM_ID", sort=False)["_Metric"].agg(list).rename("_Metric_Records")
+
+
+def join_caiq_metrics(caiq, metric_records, prev_ccm_id="", prev_category=""):
+    """Filter CAIQ rows by the run options and left-join their metric records in one pass.
+       _First_In_CCM marks the first printed row of each CCM ID, where its metrics go.
+       prev_ccm_id and prev_category continue those flags across streamed chunks.
+    """
+    keep = pd.Series(True, index=caiq.index)
+    # See https://stackoverflow.com/questions/23866442/how-to-implement-efficient-filtering-logic-in-python
+    if print_annually_only == True :
+        keep &= caiq["_Question"].str.contains("annual", regex=False)
+    if print_answers_only == True :   # ignore lines with no answers
+        keep &= (caiq["_Answer"] != "") | (caiq["_Answer_ID"] != "")
+    printed = caiq[keep].merge(metric_records, how="left", left_on="_CCM_ID", right_index=True)
+    printed["_First_In_CCM"] = printed["_CCM_ID"] != printed["_CCM_ID"].shift(fill_value=prev_ccm_id)
+    printed["_First_In_Category"] = printed["_Category"] != printed["_Category"].shift(fill_value=prev_category)
+    return printed
+
+
+def check_sorted_chunk(keys, prev_key, file_name):
+    """Raise ValueError unless keys (a Series) ascend from prev_key, as the merge-join needs."""
+    if len(keys.index) == 0 :
+        return prev_key
+    if not keys.is_monotonic_increasing or keys.iloc[0] < prev_key :
+        raise ValueError(file_name +" is not sorted by CCM ID (near "+ str(keys.iloc[0]) +"), needed for streaming mode.")
+    return keys.iloc[-1]
+
+
+def iter_metric_groups(metrics_file, chunk_rows):
+    """Yield (ccm_id, [metric records]) in file order, reading metrics_file in chunks.
+       A group split across a chunk boundary is carried over, so each CCM ID is yielded once.
+    """
+    carry_key, carry = None, []
+    prev_key = ""
+    for chunk in pd.read_csv(metrics_file, encoding="ISO-8859-1", sep = ",", dtype=str,
+                             keep_default_na=False, chunksize=chunk_rows):
+        prev_key = check_sorted_chunk(chunk["_CCM_ID"], prev_key, metrics_file)
+        chunk["_Metric"] = metric_records_column(chunk)
+        for ccm_id, records in chunk.groupby("_CCM_ID", sort=False)["_Metric"]:
+            if ccm_id == carry_key :
+                carry.extend(records)
+                continue
+            if carry_key is not None :
+                yield carry_key, carry
+            carry_key, carry = ccm_id, list(records)
+    if carry_key is not None :
+        yield carry_key, carry
+
+
+class SortedGroupCursor:
+    """Merge-join side for groups in ascending key order: take() keys must not go backwards,
+       so groups before the current key are dropped and only one group is held at a time.
+    """
+    def __init__(self, groups):
+        self._groups = iter(groups)
+        self._current = next(self._groups, None)
+
+    def take(self, key):
+        while self._current is not None and self._current[0] < key :
+            self._current = next(self._groups, None)
+        if self._current is not None and self._current[0] == key :
+            return self._current[1]
+        return []
+
+
+def build_caiq_items(caiq_rows, start=1):
+    """Return the intermediate representation: one plain dict per printed CAIQ row.
+       Every renderer (Markdown, HTML, JSON, console) works from these records only.
+    """
+    items = []
+    for number, row in enumerate(caiq_rows.to_dict("records"), start=start):
+        metrics = row["_Metric_Records"] if isinstance(row["_Metric_Records"], list) else []  # NaN: no match
+        show_metrics = bool_print_metrics and row["_First_In_CCM"]
+        items.append({
+            "number": number,
+            "qid": row["_QID"],
+            "ccm_id": row["_CCM_ID"],
+            "title": row["_Title_Filled"],
+            "question": row["_Question"] if print_questions else None,
+            "answer_id": row["_Answer_ID"] if print_answers else "",
+            "answer": row["_Answer"] if print_answers else "",
+            "category": ({"code": row["_Category"], "name": caiq_categories[row["_Category"]]}
+                         if bool_print_categories and row["_First_In_Category"] else None),
+            "metrics": metrics if show_metrics else [],
+            "metrics_missing": bool(show_metrics and not metrics),
+            })
+    return items
+
+
+def build_caiq_document(caiq_file, items=(), file_prefix=None, subject_text=None):
+    """Return the document records: front matter, headings, items and run stats.
+       When streaming, items stay empty here and the stats are filled in at the end.
+       file_prefix and subject_text default to the single-product settings above.
+    """
+    items = list(items)
+    file_prefix = file_prefix or output_file_prefix
+    subject_text = subject_text or file_subject_text
+    return {
+        "front_matter": {
+            "layout": "post",
+            "date": output_file_date,
+            "file": file_prefix,
+            "title": "CAIQ (Consensus Assessment Initiative Questionnaire) " + subject_text +".",
+            "excerpt": run_stats_line +" generated from file "+ os.path.basename(caiq_file) +" by "+ this_program_name,
+            "tags": ["cloud", "security", "management", "audit"],
+            },
+        "heading": run_stats_line +" in the CAIQ "+ subject_text +" (by Category)",
+        "category_list": caiq_categories if print_category_list else {},
+        "items": items,
+        "stats": {"caiq_rows_read": 0, "categories": 0, "metrics": 0, "items": 0},
+        }
+
+
+def count_items(stats, items):
+    stats["categories"] += sum(1 for item in items if item["category"])
+    stats["metrics"] += sum(len(item["metrics"]) for item in items)
+    stats["items"] += len(items)
+
+
+def line_prefix_for(number):
+    """Indent continuation lines under a Markdown list item numbered `number`."""
+    if number < 10 :
+        return "   "     # 3 spaces
+    elif number < 100 :
+        return "    "    # 4 spaces
+    return "     "       # 5 spaces
+
+
+def metric_html(metric):
+    return ('<a name="'+ metric["metric_id"] +'"></a>'+ metric["metric_id"] +" CCM METRIC SLO: "+ metric["slo"]
+        +" <strong>" + metric["title"] +"</strong> = " + metric["desc"])
+        # +" ("+ metric['note'] +")"
+
+
+def stats_text(stats):
+    return (str(stats["caiq_rows_read"]) +" CAIQ rows in, "+ str(stats["categories"]) +" categories, "
+        + str(stats["metrics"]) +" CCM metrics. "+ str(stats["items"]) +" questions+answers printed.")
+
+
+def render_front_matter(doc, out):
+    fm = doc["front_matter"]
+    out.append("---\r\n")
+    out.append("layout: "+ fm["layout"] +"\r\n")
+    out.append("date: \""+ fm["date"] +"\"\r\n")
+    out.append("file: \""+ fm["file"] +"\"\r\n")
+    out.append("title: \""+ fm["title"] +"\"\r\n")
+    out.append("excerpt: \""+ fm["excerpt"] +"\"\r\n")
+    out.append("tags: ["+ ", ".join(fm["tags"]) +"]\r\n")
+    out.append("---\r\n")
+#    out.append("\r\n")
+#    out.append("<!-- At https://github.com/bomonike/fullest-stack/blob/main/python/caiq-yaml-gen/ -->\r\n")
+#    out.append("\r\n")
+
+
+def render_category_list(doc, out):
+    if doc["category_list"] :
+        out.append("## Categories in the CAIQ : \r\n")
+        out.append("\r\n")
+        for key, value in doc["category_list"].items():
+            out.append("1. <a href=\"#"+ key +"-\"><tt>"+ key +"</tt></a> = "+ value +" \r\n")
+        out.append("\r\n<hr />\r\n")
+
+
+# Each renderer has a head, items and tail part, so streaming mode can write items chunk by chunk.
+# The state dict carries running counters between calls for the items of one document.
+
+def markdown_head(doc, out, console=False):
+    """console=True leaves out the front matter."""
+    if not console :
+        render_front_matter(doc, out)
+    render_category_list(doc, out)
+    out.append("\r\n")
+    out.append("## "+ doc["heading"] +"\r\n")
+    out.append("\r\n")
+
+
+def markdown_items(items, state, out, console=False):
+    """console=True adds "No metric" notices."""
+    for item in items:
+        line_prefix = line_prefix_for(item["number"])
+        category = item["category"]
+        if category :
+            # For GitHub Markdown weirdness: no indent until the second category.
+            category_prefix = "" if state.get("category_lines_out", 0) <= 1 else line_prefix
+            out.append("\r\n"+ category_prefix +'<a name="'+ category["code"] +'-"></a>\r\n')
+            if category_format == "bold" :
+                category_display = category_prefix+"<strong>"+ category["code"] +" = "+ category["name"] + "</strong>"
+            else:
+                category_display = category_prefix+"### "+ category["code"] +" = "+ category["name"]
+            out.append("\r\n"+ category_display +"\r\n \r\n")
+            state["category_lines_out"] = state.get("category_lines_out", 0) + 1
+        if console and item["metrics_missing"] :
+            out.append(line_prefix+"*** No metric for "+ item["ccm_id"] +"\r\n")
+        for metric in item["metrics"]:
+            out.append('\r\n\r\n'+line_prefix+'<table border="1" cellpadding="4" cellspacing="0"><tr valign="top"><td>'+ metric_html(metric) +'</td></tr></table>\r\n')
+        # Mix of ' and " works?
+        out.append("\r\n"+ str(item["number"]) +'. <a name="'+ item["qid"] +'"></a>'+ item["qid"] +" - "+ item["title"] +"\r\n")
+        if item["question"] is not None :
+            out.append("\r\n"+ line_prefix + item["question"])
+        if len(item["answer_id"]) != 0 :  # blank value
+            out.append("\r\n"+ line_prefix +"ANSWER : "+ item["answer_id"] +" : "+ item["answer"] +"\r\n")
+
+
+def markdown_tail(doc, out, console=False):
+    if console :
+        out.append("\r\n*** "+ stats_text(doc["stats"]) +"\r\n")
+    else:
+        out.append("\r\n<-- "+ stats_text(doc["stats"]) +" -->")
+
+
+def html_head(doc, out):
+    render_front_matter(doc, out)
+    render_category_list(doc, out)
+    out.append("\r\n")
+    out.append("## "+ doc["heading"] +"\r\n")
+    out.append("\r\n")
+    out.append('<table border="1" cellpadding="4" cellspacing="0">\r\n')
+    out.append('<tr valign="bottom"><th> CAIQ Item & Title </th><th> Question </th><th> Answer </th></tr>\r\n')
+    out.append("\r\n")
+
+
+def html_items(items, state, out):
+    for item in items:
+        category = item["category"]
+        if category :
+            out.append('\r\n<tr valign="top"><td colspan="4"><a name="'+ category["code"] +'-"></a>\r\n')
+            out.append("<strong>"+ category["code"] +" = "+ category["name"] + '</strong></td></tr>\r\n')
+        for metric in item["metrics"]:
+            out.append('<tr valign="top"><td colspan="4">'+ metric_html(metric) +'</td></tr>\r\n')
+        out.append('<tr valign="top"><td>'+ str(item["number"]) +'. <a href="#'+ item["qid"] +'"></a>'+ item["qid"] +" - "+ item["title"])
+        if item["question"] is not None :
+            out.append("</td><td> " + item["question"])
+        # Always close an answer cell, so rows without an answer keep the columns aligned:
+        out.append("</td><td>" + (item["answer"] if len(item["answer_id"]) != 0 else ""))
+        out.append('\r\n</td></tr>\r\n')
+
+
+def html_tail(doc, out):
+    out.append('</table>')
+    out.append("\r\n")
+    out.append("\r\n<!-- "+ stats_text(doc["stats"]) +" -->")
+
+
+def json_head(doc, out):
+    """Everything but items and stats, then open the items array."""
+    head = {key: value for key, value in doc.items() if key not in ("items", "stats")}
+    out.append(json.dumps(head, indent=2, ensure_ascii=False)[:-2] +',\n  "items": [')
+
+
+def json_items(items, state, out):
+    for item in items:
+        out.append(("\n    " if state.get("items_out", 0) == 0 else ",\n    ") + json.dumps(item, ensure_ascii=False))
+        state["items_out"] = state.get("items_out", 0) + 1
+
+
+def json_tail(doc, out):
+    out.append('\n  ],\n  "stats": '+ json.dumps(doc["stats"]) +"\n}\n")
+
+
+renderers = {
+    "markdown": (markdown_head, markdown_items, markdown_tail),
+    "html": (html_head, html_items, html_tail),
+    "json": (json_head, json_items, json_tail),
+    }
 
-if bool_print_metrics == True :
-   # pd=pandas, df=dataframe (table) instead of default encoding="utf-8" :
-   df = pd.read_csv(metrics_file_to_open, encoding="ISO-8859-1", sep = ",")
-       # , names = ['col1', 'col2', 'col3', 'col4'])      na_values=["0"]
-       # Alternately, into dict: a = pd.read_csv("File1.txt", delimiter=" ", header = None).to_dict()[0]
-   # print(df)  # display entire dataframe. Alternately: df.head()
-   # print(pd.options.display.max_rows) 
-   df.set_index("_CCM_ID", inplace = True)
-       # See https://pandas.pydata.org/docs/user_guide/indexing.html#indexing
-   if bool_output_console == True :
-      print( "*** In "+ metrics_file_to_open +" are "+ str(len(df.index)) +" rows (excluding title row) \r\n")
-         # Alternately, print(pd.options.display.max_rows) 
 
-   # TODO: Print list of CCM metrics described at https://cloudsecurityalliance.org/artifacts/metrics-and-measurements-for-the-csa-ccm/ and PDF downloaded from https://cloudsecurityalliance.org/download/artifacts/metrics-and-measurements-for-the-csa-ccm/
+def render_document(doc, output_format):
+    """Return the whole document as a list of fragments in output_format."""
+    head, items, tail = renderers[output_format]
+    out = []
+    head(doc, out)
+    items(doc["items"], {}, out)
+    tail(doc, out)
+    return out
 
 
-# Output yaml heading and table heading:
-if bool_output_file == True :
-    f.write("\r\n")
-    f.write("## "+ run_stats_line +" in the CAIQ "+ file_subject_text +" (by Category)\r\n")
-    f.write("\r\n")
-    if bool_output_table == True :
-        f.write('<table border="1" cellpadding="4" cellspacing="0">\r\n')
-        f.write('<tr valign="bottom"><th> CAIQ Item & Title </th><th> Question </th><th> Answer </th></tr>\r\n')
-        f.write("\r\n")
-
-
-with open(caiq_file_to_open, mode='r') as csv_file:
-    csv_reader = csv.DictReader(csv_file)
-    caiq_rows_read = 0
-    caiq_rows_printed = 0
-    prev_first_qid_chars=""
-    metric_rows_printed = 0
-    prev_caiq_ccm_id=""
-    
-    category_lines_out=0
-    prev_title=""  # Def for next row.
-
-    for row in csv_reader:
-        if caiq_rows_read == 0:
-            print(f'*** Column names are {", ".join(row)}')
+def render_console(doc):
+    out = []
+    markdown_head(doc, out, console=True)
+    markdown_items(doc["items"], {}, out, console=True)
+    markdown_tail(doc, out, console=True)
+    return out
+
+
+def write_document(fragments, output_file):
+    """Write all fragments in one buffered call, replacing any previous file.
+       newline="" keeps the \\r\\n line ends as rendered on every platform.
+    """
+    with open(output_file, "w", encoding="utf-8", newline="") as out_file:
+        out_file.write("".join(fragments))
+
+
+def generate_caiq_document(caiq_file, metric_records, output_file, console_lines,
+                           file_prefix=None, subject_text=None):
+    """Join, render and write one CAIQ document held in memory."""
+    caiq = read_caiq_frame(caiq_file)
+    if bool_output_console == True :
+        console_lines.append(f'*** Column names are {", ".join(caiq.columns[:7])}\r\n')
             #  ID, _QID, _Title, _Question, _Answer_ID, _Answer
-            # WARNING: Retrieving first column (ID) causes an error.
-            caiq_rows_read += 1
-
-        # Rest of lines: Get first 3 characters of _QID for Categories:
-        first_qid_chars=row["_QID"][0:3]   # such as "A&A"
-        caiq_ccm_id=row["_QID"][0:6]       # such as "A&A-01" to lookup metric 
-        
-        bool_print_caiq_line=True   # starting with all lines unless restricted.
-
-        # See https://stackoverflow.com/questions/23866442/how-to-implement-efficient-filtering-logic-in-python
-        if (row["_Question"].find('annual') != -1) :  # NOT FOUND
-            if print_annually_only == True :
-                bool_print_caiq_line=False
-    
-        if len(row["_Answer"]) == 0 and len(row["_Answer_ID"]) == 0 :  # Answer NOT present in line:
-            if print_answers_only == True :  
-                bool_print_caiq_line=False   # ignore lines with no answers
-    
-        # Print only if there is an answer: Print only if there is no answer:
-        # if print_filter == "all" or len(row["_Answer"]) > 0 :
-        if bool_print_caiq_line == True :
-            caiq_rows_printed += 1
-            if caiq_rows_printed < 10 :
-               line_prefix="   "  # 3 spaces
-            elif caiq_rows_printed < 100 :
-               line_prefix="    "  # 4 spaces
-            else:  # more than 999:
-               line_prefix="     "  # 5 spaces
-
-            # TODO: Instead Lookup CategoryText & CCM from csv file?
-            # Lookup CategoryText from in-code table:
-            if bool_print_categories == True :
-                if first_qid_chars != prev_first_qid_chars :
-
-                    # For GitHub Markdown weirdness:x
-                    if category_lines_out <= 1 :  # Except first line 
-                        category_prefix=""       # for GitHub Markdown weirdness
-                    else:
-                        category_prefix=line_prefix
-
-                    category_text = caiq_categories[first_qid_chars]
-                    category_line='<a name="'+ first_qid_chars +'-"></a>\r\n'
-                    if bool_output_console == True :
-                        print("\r\n"+ category_prefix+category_line+"\r\n")
-                    if bool_output_file == True :
-                        if bool_output_table == True :
-                            f.write('\r\n<tr valign="top"><td colspan="4">' +category_line )
-                        else:
-                            f.write("\r\n"+ category_prefix + category_line)
-
-                    if category_format == "bold" :
-                        category_display = category_prefix+"<strong>"+ first_qid_chars +" = "+ category_text + "</strong>"
-                    else:
-                        category_display = category_prefix+"### "+ first_qid_chars +" = "+ category_text
-
-                    category_line="\r\n"+ category_display +"\r\n \r\n"
-                    if bool_output_console == True :
-                        print(category_line)
-                    if bool_output_file == True :
-                        if bool_output_table == True :
-                            f.write("<strong>"+ first_qid_chars +" = "+ category_text + '</strong></td></tr>\r\n')
-                        else:
-                            f.write(category_line)
-
-                    category_lines_out += 1
-                    prev_first_qid_chars=first_qid_chars  # for next row.
-
-
-            if bool_print_metrics == True :
-                caiq_ccm_id=row["_QID"][0:6]       # such as "A&A-01" to lookup metric 
-                metrics_line=""  # clear from previous.
-                if caiq_ccm_id != prev_caiq_ccm_id :
-                    try:
-                        #if df.loc[caiq_ccm_id,'_Metric_ID'].shape[0] == 2 :
-#                        print(df.loc[caiq_ccm_id]) 
-                        #print( df[df['????'] == caiq_ccm_id])
-                        # `print`( "shape"+ df.loc[caiq_ccm_id,'_CCM_ID'].shape[0] )
-                        print("ccm="+ caiq_ccm_id +" shape="+ str(df.loc[caiq_ccm_id].shape[0]) )
-                        # print("*** Column names are {" + .join(mrow) )
-
-                           # TODO: This recognizes either 2 or 1 metric lines per CCM_ID key (not 3 rows per key)
-                        if df.loc[caiq_ccm_id].shape[0] == 2 :
-                            for index, mrow in df.loc[caiq_ccm_id].iterrows() :
-                                metrics_line='<a name="'+ mrow['_Metric_ID'] +'"></a>'+ mrow['_Metric_ID'] +" CCM METRIC SLO: "+ mrow['_SLO'] +" <strong>" + mrow['_Metric_Title'] +"</strong> = " + mrow['_Metric_Desc']
-                                # +" ("+ mrow['_Note1'] +")"
-                                
-                                if bool_output_console == True :
-                                    print("\r\n"+line_prefix+metrics_line +"\r\n")
-                                if bool_output_file == True :
-                                    if bool_output_table == True :
-                                        f.write('<tr valign="top" colspan="4"><td>'+metrics_line+'</td></tr')
-                                    else:
-                                        f.write('\r\n\r\n'+line_prefix+'<table border="1" cellpadding="4" cellspacing="0"><tr valign="top"><td>'+ metrics_line +'</td></tr></table>\r\n')
-                                metric_rows_printed += 1
-                        else:  # QUESTION: Why is ccm=AIS-06 shape=6 ?
-                                metrics_line='<a name="'+ df.loc[caiq_ccm_id,'_Metric_ID'] +'"></a>'+ df.loc[caiq_ccm_id,'_Metric_ID'] +" CCM METRIC SLO: "+ df.loc[caiq_ccm_id,'_SLO'] +" <strong>" + df.loc[caiq_ccm_id,'_Metric_Title'] +"</strong> = " + df.loc[caiq_ccm_id,'_Metric_Desc'] 
-                                #+" (" + df.loc[caiq_ccm_id,'_Note1'] +")"
-
-                                if bool_output_console == True :
-                                    print("\r\n"+line_prefix+metrics_line +"\r\n")
-                                if bool_output_file == True :
-                                    if bool_output_table == True :
-                                        f.write('<tr valign="top" colspan="4"><td>'+metrics_line+'</td></tr')
-                                    else:
-                                        f.write('\r\n\r\n'+line_prefix+'<table border="1" cellpadding="4" cellspacing="0"><tr valign="top"><td>'+ metrics_line +'</td></tr></table>\r\n')
-                                metric_rows_printed += 1
-
-                    except:
-                        # FIX: error when more than one metric for a CAIQ CCM ID. AIS-07-M3 & AIS-07-M6
-                        # TODO: Check in dataframe if response
-                            # SEF-06         <a name="SEF-06-M1">CCM SEF-06-M1</a> MET...
-                            # SEF-06         <a name="SEF-06-M2">CCM SEF-06-M2</a> MET...
-                            # dtype: object
-                        # TODO: Loop for multiple metrics per CAIQ item
-                        if bool_output_console == True :
-                            print(line_prefix+"*** No metric for "+ caiq_ccm_id )
-                            quit
-                    prev_caiq_ccm_id=caiq_ccm_id  # for next row.
-
-
-            # If no title, get from previous row:
-            if len(row["_Title"]) == 0 :
-                caiq_title=prev_title
-            else :
-                caiq_title=row["_Title"]
-            # Mix of ' and " works?
-            title_line="\r\n"+ str(caiq_rows_printed) +'. <a name="'+ row["_QID"] +'"></a>'+ row["_QID"] +" - "+ caiq_title +"\r\n"
-            if bool_output_console == True :
-                print(title_line)
-            if bool_output_file == True :
-                if bool_output_table == True :
-                    f.write('<tr valign="top"><td>'+ str(caiq_rows_printed) +'. <a href="#'+ row["_QID"] +'"></a>'+ row["_QID"] +" - "+ caiq_title )
-                else:
-                    f.write(title_line)
-
-            if print_questions == True :
-                question_text=line_prefix + row["_Question"]
+    document = build_caiq_document(caiq_file, build_caiq_items(join_caiq_metrics(caiq, metric_records)),
+                                   file_prefix, subject_text)
+    document["stats"]["caiq_rows_read"] = len(caiq.index)
+    count_items(document["stats"], document["items"])
+
+    if bool_output_file == True :
+        write_document(render_document(document, output_format), output_file)
+    if bool_output_console == True :
+        console_lines.extend(render_console(document))
+    return document["stats"]
+
+
+def stream_caiq_document(caiq_file, metrics_file, output_file, chunk_rows,
+                         file_prefix=None, subject_text=None):
+    """Merge-join caiq_file and metrics_file chunk by chunk, writing each chunk as it is rendered.
+       Both files must be sorted by CCM ID. Memory holds one chunk of each, not whole files.
+       Chunks go to a .tmp file renamed to output_file at the end, so a csv that fails
+       part way (or is not a CAIQ at all) leaves no partial output_file behind.
+    """
+    document = build_caiq_document(caiq_file, (), file_prefix, subject_text)
+    stats = document["stats"]
+    head, render_items, tail = renderers[output_format]
+    file_state, console_state = {}, {}
+    cursor = SortedGroupCursor(iter_metric_groups(metrics_file, chunk_rows) if bool_print_metrics else ())
+    prev_title, prev_ccm_id, prev_category, prev_key = "", "", "", ""
+
+    tmp_file = output_file + ".tmp"
+    out_file = open(tmp_file, "w", encoding="utf-8", newline="") if bool_output_file else None
+    try:
+        out, console = [], []
+        if out_file :
+            head(document, out)
+        if bool_output_console == True :
+            markdown_head(document, console, console=True)
+        with open(caiq_file, mode='r', encoding="utf-8-sig") as csv_file:
+            for chunk in pd.read_csv(csv_file, dtype=str, keep_default_na=False, chunksize=chunk_rows):
+                chunk = prepare_caiq_frame(chunk, prev_title)
+                prev_key = check_sorted_chunk(chunk["_CCM_ID"], prev_key, caiq_file)
+                ccm_ids = chunk["_CCM_ID"].unique()
+                metric_records = pd.Series([cursor.take(ccm_id) for ccm_id in ccm_ids],
+                                           index=ccm_ids, name="_Metric_Records", dtype=object)
+                caiq_rows = join_caiq_metrics(chunk, metric_records, prev_ccm_id, prev_category)
+                items = build_caiq_items(caiq_rows, start=stats["items"] + 1)
+
+                stats["caiq_rows_read"] += len(chunk.index)
+                count_items(stats, items)
+                prev_title = chunk["_Title_Filled"].iloc[-1]
+                if len(caiq_rows.index) :
+                    prev_ccm_id = caiq_rows["_CCM_ID"].iloc[-1]
+                    prev_category = caiq_rows["_Category"].iloc[-1]
+
+                # One write per chunk for the file and for the console mirror:
+                if out_file :
+                    render_items(items, file_state, out)
+                    out_file.write("".join(out))
+                    out = []
                 if bool_output_console == True :
-                    print("\r\n"+question_text)
-                if bool_output_file == True :
-                    if bool_output_table == True :
-                        f.write("</td><td> " + row["_Question"] )
-                    else:
-                        f.write("\r\n"+question_text)
-
-            #if bool_output_table == True :
-            #    f.write("</td><td> Y ")
-
-            if print_answers == True :
-                if len(row["_Answer_ID"]) != 0 :  # blank value
-                    answer_text=row["_Answer_ID"] + " : "+ row["_Answer"]
-                    answer_line=line_prefix+ "ANSWER : "+ answer_text +"\r\n"
-                    if bool_output_console == True :
-                        print("\r\n"+answer_line)
-                    if bool_output_file == True :
-                        if bool_output_table == True :
-                            f.write("</td><td>" + row["_Answer"] )
-                        else:
-                            f.write("\r\n"+answer_line)
-
-            if bool_output_table == True :
-                f.write('\r\n</td></tr>\r\n')
-
-        caiq_rows_read += 1
-#        if caiq_rows_read > stop_after_caiq_item :  # after AIS-07 at 18
-#           quit
-        if len(row["_Title"]) > 0 :
-           prev_title=row["_Title"]  # Save for next row if title is blank
-
-    last_stats_line=str(caiq_rows_read) +" CAIQ rows in, "+ str(category_lines_out) +" categories, "+ str(metric_rows_printed) +" CCM metrics. "+ str(caiq_rows_printed) +" questions+answers printed."
+                    markdown_items(items, console_state, console, console=True)
+                    sys.stdout.write("".join(console))
+                    console = []
+        if out_file :
+            tail(document, out)
+            out_file.write("".join(out))
+        if bool_output_console == True :
+            markdown_tail(document, console, console=True)
+            sys.stdout.write("".join(console))
+            sys.stdout.flush()
+    except BaseException:
+        if out_file :
+            out_file.close()
+            os.remove(tmp_file)
+        raise
+    if out_file :
+        out_file.close()
+        os.replace(tmp_file, output_file)
+    return stats
+
+
+def load_metric_records(metrics_file, console_lines):
+    """Read metrics_file once and group its metric records by CCM ID."""
+    # pd=pandas, df=dataframe (table) instead of default encoding="utf-8" :
+    # Parsed from text only when metrics.csv changes; otherwise memory-mapped from .snapshots/
+    df = snapshot_cache.read_csv_snapshot(metrics_file, encoding="ISO-8859-1", sep = ",", index_col="_CCM_ID")
+        # , names = ['col1', 'col2', 'col3', 'col4'])      na_values=["0"]
+        # Alternately, into dict: a = pd.read_csv("File1.txt", delimiter=" ", header = None).to_dict()[0]
+    # print(df)  # display entire dataframe. Alternately: df.head()
+        # See https://pandas.pydata.org/docs/user_guide/indexing.html#indexing
     if bool_output_console == True :
-        print("*** "+ last_stats_line)
-    if bool_output_file == True :
-        if bool_output_table == True :
-            f.write('</table>')
-            f.write("\r\n")
-        f.write("\r\n<-- "+ last_stats_line +" -->")
+        console_lines.append( "*** In "+ metrics_file +" are "+ str(len(df.index)) +" rows (excluding title row) \r\n")
+    # TODO: Print list of CCM metrics described at https://cloudsecurityalliance.org/artifacts/metrics-and-measurements-for-the-csa-ccm/ and PDF downloaded from https://cloudsecurityalliance.org/download/artifacts/metrics-and-measurements-for-the-csa-ccm/
+    return metric_records_by_ccm_id(df)
+
+
+def product_names(caiq_file):
+    """Return (file prefix, subject text) for a per-product file like CAIQ4.0.1.consul.csv."""
+    file_prefix = os.path.splitext(os.path.basename(caiq_file))[0]   # CAIQ4.0.1.consul
+    product = file_prefix.rsplit(".", 1)[-1]                        # consul
+    return file_prefix, "for "+ product.capitalize() +" users' auditors"
+
+
+# Set in each batch worker process by init_batch_worker():
+batch_metric_records = None
+
+
+def init_batch_worker(metric_records, options):
+    """Process pool initializer: receive the metrics index and run options once per worker,
+       rather than once per product.
+    """
+    global batch_metric_records
+    batch_metric_records = metric_records
+    globals().update(options)
+
+
+def render_product(caiq_file, metrics_file, output_dir):
+    """Worker task: write the document for one product's CAIQ file. Returns its stats."""
+    file_prefix, subject_text = product_names(caiq_file)
+    output_file = os.path.join(output_dir, output_file_date +"-"+ file_prefix + output_file_extensions[output_format])
+    if bool_stream_chunks == True :
+        stats = stream_caiq_document(caiq_file, metrics_file, output_file, stream_chunk_rows,
+                                     file_prefix, subject_text)
+    else:
+        stats = generate_caiq_document(caiq_file, batch_metric_records, output_file, [],
+                                       file_prefix, subject_text)
+    return caiq_file, output_file, stats
+
+
+def run_batch(caiq_dir, metrics_file, output_dir, max_workers=None):
+    """Render every CAIQ csv in caiq_dir (one per product) in a process pool.
+       A file that fails is reported and skipped, so the other products are still rendered.
+       Returns (results, failures) where failures is a list of (caiq_file, exception).
+    """
+    metrics_path = os.path.abspath(metrics_file)
+    caiq_files = sorted(path for path in glob.glob(os.path.join(caiq_dir, "*.csv"))
+                        if os.path.abspath(path) != metrics_path)
+    if not caiq_files :
+        print("*** No CAIQ .csv files in "+ caiq_dir)
+        return [], []
+    os.makedirs(output_dir, exist_ok=True)
+    # Streaming workers read metrics_file in chunks themselves, so skip the shared index then.
+    metric_records = None if bool_stream_chunks else load_metric_records(metrics_file, [])
+    options = {"output_format": output_format, "bool_stream_chunks": bool_stream_chunks,
+               "bool_output_console": False}
+
+    results = []
+    failures = []
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_batch_worker,
+                             initargs=(metric_records, options)) as pool:
+        futures = {pool.submit(render_product, caiq_file, metrics_file, output_dir): caiq_file
+                   for caiq_file in caiq_files}
+        for future in as_completed(futures):
+            try:
+                caiq_file, output_file, stats = future.result()
+            except Exception as e:   # such as a csv without CAIQ columns (KeyError '_QID')
+                print("*** FAILED "+ futures[future] +": "+ type(e).__name__ +" "+ str(e), file=sys.stderr)
+                failures.append((futures[future], e))
+                continue
+            if bool_output_console == True :
+                print("*** "+ output_file +" from "+ caiq_file +": "+ stats_text(stats))
+            results.append((caiq_file, output_file, stats))
+    if failures :
+        print("*** "+ str(len(failures)) +" of "+ str(len(caiq_files)) +" CAIQ files failed.", file=sys.stderr)
+    return results, failures
+
+
+class TestStreamCaiq(unittest.TestCase):
+    """Streaming mode must write the same bytes as the in-memory mode. Run with --self-test."""
+    CAIQ_ROWS = [   # sorted by _QID, across 3 categories, with titles left blank after the first
+        ("1", "A&A-01.1", "Audit Planning", "Are audit plans developed?", "Yes", "Annually."),
+        ("2", "A&A-01.2", "", "Are audit plans reviewed?", "", ""),
+        ("3", "A&A-02.1", "Independent Audits", "Are audits independent?", "Yes", "By a third party."),
+        ("4", "AIS-07.1", "Remediation", "Are flaws remediated?", "Yes", "Within 30 days."),
+        ("5", "AIS-07.2", "", "Is remediation\nautomated?", "No", ""),
+        ("6", "BCR-01.1", "Business Continuity", "Is there a plan?", "Yes", "Tested annually."),
+        ("7", "BCR-01.2", "", "Is it tested?", "", ""),
+        ("8", "BCR-02.1", "Risk Assessment", "Are risks assessed?", "Yes", "Quarterly."),
+        ]
+    METRIC_ROWS = [   # AIS-07 has two metrics, split across the first and second 3-row chunk
+        ("A&A-01", "M1", "95%", "Audit coverage", "Share of systems audited", ""),
+        ("A&A-02", "M2", "100%", "Audit independence", "Audits by third parties", ""),
+        ("AIS-07", "M3", "30 days", "Time to remediate", "Days to fix a flaw", ""),
+        ("AIS-07", "M6", "90%", "Automated fixes", "Share fixed automatically", ""),
+        ("BCR-01", "M9", "1/year", "Plan tests", "Continuity plan tests per year", ""),
+        ]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.saved_options = {name: globals()[name] for name in ("output_format", "bool_output_console")}
+        globals()["bool_output_console"] = False
+        self.caiq_file = self.write_csv("CAIQ-test.csv", ("ID", "_QID", "_Title", "_Question", "_Answer_ID", "_Answer"),
+                                        self.CAIQ_ROWS)
+        self.metrics_file = self.write_csv("metrics-test.csv",
+                                           ("_CCM_ID", "_Metric_ID", "_SLO", "_Metric_Title", "_Metric_Desc", "_Note1"),
+                                           self.METRIC_ROWS)
+
+    def tearDown(self):
+        globals().update(self.saved_options)
+        self.tmp_dir.cleanup()
+
+    def write_csv(self, file_name, columns, rows):
+        path = os.path.join(self.tmp_dir.name, file_name)
+        pd.DataFrame(rows, columns=columns).to_csv(path, index=False)
+        return path
+
+    def read_bytes(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_stream_equals_in_memory(self):
+        metric_records = load_metric_records(self.metrics_file, [])
+        for fmt in renderers:
+            globals()["output_format"] = fmt
+            in_memory_file = os.path.join(self.tmp_dir.name, "in-memory." + fmt)
+            streamed_file = os.path.join(self.tmp_dir.name, "streamed." + fmt)
+            in_memory_stats = generate_caiq_document(self.caiq_file, metric_records, in_memory_file, [])
+            streamed_stats = stream_caiq_document(self.caiq_file, self.metrics_file, streamed_file, 3)
+            self.assertEqual(streamed_stats, in_memory_stats, fmt)
+            self.assertEqual(self.read_bytes(streamed_file), self.read_bytes(in_memory_file), fmt)
+        self.assertEqual(in_memory_stats, {"caiq_rows_read": 8, "categories": 3, "metrics": 5, "items": 8})
+
+    def test_check_sorted_chunk(self):
+        self.assertEqual(check_sorted_chunk(pd.Series(["A&A-01", "AIS-07"]), "", "x.csv"), "AIS-07")
+        with self.assertRaises(ValueError):
+            check_sorted_chunk(pd.Series(["BCR-01", "AIS-07"]), "", "x.csv")
+        with self.assertRaises(ValueError):   # behind the last key of the previous chunk
+            check_sorted_chunk(pd.Series(["AIS-07"]), "BCR-01", "x.csv")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate CAIQ answer documents with CCM metrics.")
+    parser.add_argument("--caiq-dir", help="folder of CAIQ csv files, one per product, rendered in a process pool")
+    parser.add_argument("--metrics", default=metrics_file_to_open, help="metrics csv shared by all products")
+    parser.add_argument("--output-dir", default=".", help="folder for the per-product output files")
+    parser.add_argument("--format", choices=sorted(renderers), default=output_format)
+    parser.add_argument("--workers", type=int, default=None, help="process pool size (default: CPU count)")
+    parser.add_argument("--stream", action="store_true", default=bool_stream_chunks,
+                        help="merge-join the csv files in chunks (both sorted by CCM ID)")
+    parser.add_argument("--self-test", action="store_true", help="run the checks in TestStreamCaiq, then exit")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    global output_format, bool_stream_chunks, output_file_name
+    args = parse_args(argv)
+    if args.self_test :
+        unittest.main(argv=[sys.argv[0]])   # runs the TestCase classes of this file
+    output_format = args.format
+    bool_stream_chunks = args.stream
+    output_file_name=output_file_date+"-"+output_file_prefix+output_file_extensions[output_format]
+
+    if args.caiq_dir :
+        results, failures = run_batch(args.caiq_dir, args.metrics, args.output_dir, args.workers)
+        if failures :
+            sys.exit(1)
+        return
+
+    # Output yaml heading:
+    console_lines = []   # Console mirror, written in one call at the end.
+    if bool_output_console == True :
+        console_lines.append("*** "+ str(local_dt) +" "+ local_tzname +"\r\n")
+        console_lines.append("*** "+ run_stats_line +"\r\n")
+
+    if bool_stream_chunks == True :
+        # Both csv files must already be sorted by CCM ID (CAIQ files come sorted by _QID).
+        if bool_output_console == True :
+            sys.stdout.write("".join(console_lines))
+        stream_caiq_document(caiq_file_to_open, args.metrics, output_file_name, stream_chunk_rows)
+    else:
+        if bool_print_metrics == True :
+            metric_records = load_metric_records(args.metrics, console_lines)
+        else:
+            metric_records = pd.Series([], name="_Metric_Records", dtype=object)
+
+        generate_caiq_document(caiq_file_to_open, metric_records, output_file_name, console_lines)
+        if bool_output_console == True :
+            sys.stdout.write("".join(console_lines))
+            sys.stdout.flush()
 
     # TODO: Display elapsed time for run:
     # from dateutil import relativedelta
     # relativedelta.relativedelta(end_time,start_time).seconds
 
-    f.close()
\ No newline at end of file
+
+if __name__ == "__main__":   # so process pool workers can import this file without running it.
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# multikey_index.py in https://github.com/wilsonmar/python-samples/blob/main/multikey_index.py
+"""Keyed lookups that return every matching row, for data like nba-2.csv.
+
+   df.loc["Avery Bradley"] on an unsorted, non-unique index scans or hashes the whole
+   index on each call. MultiKeyIndex sorts the rows by the key once (stable argsort),
+   keeps each column as a NumPy array in that order, and records where each key's run
+   of rows starts and stops. A lookup is then one dict hit plus slicing, and the
+   returned columns are views into the shared arrays (no copies).
+
+   Secondary indexes (such as Team, Position, College) hold the row positions sorted
+   by that column, so their lookups return a view of positions; the column values are
+   gathered from those positions only when asked for.
+
+   Usage:
+       from multikey_index import MultiKeyIndex
+       players = MultiKeyIndex.from_csv("nba-2.csv", "Name", secondary=("Team", "Position", "College"))
+       rows = players.lookup("Avery Bradley")          # RowSlice of views
+       celtics = players.lookup_by("Team", "Boston Celtics")
+       guards = players.where(Team="Boston Celtics", Position="PG")
+"""
+
+import numpy as np   # installed with pandas
+import pandas as pd  # after pip install pandas
+
+import snapshot_cache
+
+
+class RowSlice:
+    """Rows matching one lookup, as a dict of equal-length column arrays."""
+    __slots__ = ("columns",)
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        for values in self.columns.values():
+            return len(values)
+        return 0
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def __iter__(self):
+        """Iterate rows as tuples, in column order."""
+        return zip(*self.columns.values())
+
+    def __repr__(self):
+        return "RowSlice(%d rows, columns=%s)" % (len(self), list(self.columns))
+
+    def records(self):
+        """Return the rows as a list of dicts of Python values (copies), e.g. for printing."""
+        names = list(self.columns)
+        return [dict(zip(names, row)) for row in zip(*(values.tolist() for values in self.columns.values()))]
+
+    def to_frame(self):
+        return pd.DataFrame(self.columns)
+
+
+def group_bounds(values):
+    """Return (order, {key: (start, stop)}) for values sorted by a stable argsort.
+       Missing values (NaN/None) are left out of the key map.
+    """
+    codes, uniques = pd.factorize(values, sort=True)   # -1 marks a missing value
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    group_codes, starts, counts = np.unique(sorted_codes, return_index=True, return_counts=True)
+    bounds = {}
+    for code, start, count in zip(group_codes.tolist(), starts.tolist(), counts.tolist()):
+        if code >= 0:
+            bounds[uniques[code]] = (start, start + count)
+    return order, bounds
+
+
+class MultiKeyIndex:
+    """Rows of a DataFrame grouped into contiguous slices by a primary key column,
+       with optional secondary indexes on other columns.
+    """
+
+    def __init__(self, df, key, secondary=()):
+        if key in df.columns:
+            key_values = df[key].to_numpy()
+            df = df.drop(columns=[key])
+        elif key in df.index.names:
+            key_values = df.index.get_level_values(key).to_numpy()
+        else:
+            raise KeyError("%s is neither a column nor an index level" % key)
+        self.key = key
+        order, self._bounds = group_bounds(key_values)
+        # One reordered copy of every column, so each key's rows are contiguous:
+        self._columns = {key: key_values[order]}
+        for name in df.columns:
+            self._columns[name] = df[name].to_numpy()[order]
+        self._secondary = {}
+        for name in secondary:
+            self.add_secondary(name)
+
+    @classmethod
+    def from_csv(cls, csv_file, key, secondary=(), **read_csv_kwargs):
+        """Build from a csv file, loaded through its binary snapshot after the first run."""
+        return cls(snapshot_cache.read_csv_snapshot(csv_file, **read_csv_kwargs), key, secondary)
+
+    def add_secondary(self, column):
+        """Index another column. Positions refer to rows in primary-key order."""
+        positions, bounds = group_bounds(self._columns[column])
+        self._secondary[column] = (positions, bounds)
+
+    def __len__(self):
+        return len(self._columns[self.key])
+
+    def __contains__(self, key):
+        return key in self._bounds
+
+    def keys(self, column=None):
+        """Distinct values of the primary key, or of a secondary column, in sorted order."""
+        if column is None or column == self.key:
+            return list(self._bounds)
+        return list(self._secondary[column][1])
+
+    def lookup(self, key, columns=None):
+        """Return all rows for key as views into the shared column arrays.
+           Raises KeyError when the key is not present.
+        """
+        start, stop = self._bounds[key]
+        names = columns or self._columns
+        return RowSlice({name: self._columns[name][start:stop] for name in names})
+
+    def get(self, key, default=None, columns=None):
+        if key not in self._bounds:
+            return default
+        return self.lookup(key, columns)
+
+    def positions_by(self, column, value):
+        """Return a view of the row positions whose column equals value (empty if none)."""
+        positions, bounds = self._secondary[column]
+        start, stop = bounds.get(value, (0, 0))
+        return positions[start:stop]
+
+    def take(self, positions, columns=None):
+        """Gather rows at positions. This copies, as the rows are not contiguous."""
+        names = columns or self._columns
+        return RowSlice({name: self._columns[name][positions] for name in names})
+
+    def lookup_by(self, column, value, columns=None):
+        """Return all rows whose secondary column equals value, in primary-key order."""
+        return self.take(self.positions_by(column, value), columns)
+
+    def where(self, columns=None, **criteria):
+        """Return rows matching every column=value pair, using secondary indexes."""
+        positions = None
+        for column, value in criteria.items():
+            matched = self.positions_by(column, value)
+            positions = matched if positions is None else np.intersect1d(positions, matched, assume_unique=True)
+        if positions is None:
+            raise ValueError("where() needs at least one column=value criterion")
+        return self.take(np.sort(positions), columns)
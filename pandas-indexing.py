@@ -3,9 +3,13 @@
 # by Wilson Mar - v0.3 
 # based on https://sparkbyexamples.com/pandas/iterate-over-rows-in-pandas-dataframe/
            # (which has an analysis of the efficiency of each method as the dataset gets larger)
+           # To measure time and peak memory of each method here: python3 pandas-iteration-bench.py
 # https://www.geeksforgeeks.org/different-ways-to-iterate-over-rows-in-pandas-dataframe/
 
 import pandas as pd
+
+import snapshot_cache   # loads CSVs from a memory-mapped binary snapshot after the first run
+from multikey_index import MultiKeyIndex
 Technologys = ({
     'Courses':["Spark","Spark","PySpark","Hadoop","Python","Pandas","Oracle","Java"],
     'Fee' :[10000,20000,25000,26000,22000,24000,21000,22000],
@@ -116,11 +120,23 @@ print("***\r\n")
 # iterate through several values matching that key found.
 
 # https://www.geeksforgeeks.org/indexing-and-selecting-data-with-pandas/
-print("*** using .loc reading nba-2 "
-# making data frame from csv file
-data = pd.read_csv("nba-2.csv", index_col ="Name")  
+print("*** using .loc reading nba-2 ")
+# making data frame from csv file (re-parsed only when nba-2.csv content changes):
+data = snapshot_cache.read_csv_snapshot("nba-2.csv", index_col ="Name")
 # retrieving row by loc method
 first = data.loc["Avery Bradley"]
 second = data.loc["R.J. Hunter"]
 print(first, "\n\n\n", second)
 print("***\r\n")
+
+
+print("\r\n*** using MultiKeyIndex on nba-2 (for thousands of keyed lookups) ")
+# Rows are grouped by Name once, so each lookup returns all matches as array views:
+players = MultiKeyIndex(data, "Name", secondary=("Team", "Position", "College"))
+for player in players.lookup("R.J. Hunter").records():
+    print(player)
+print("Point guards of the Boston Celtics:")
+for name, college in players.where(Team="Boston Celtics", Position="PG", columns=("Name", "College")):
+    print("  ", name, "-", college)
+print(len(players.positions_by("College", "Texas")), "players from Texas")
+print("***\r\n")
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# pandas-iteration-bench.py in https://github.com/wilsonmar/python-samples/blob/main/pandas-iteration-bench.py
+"""Benchmark the DataFrame row-iteration idioms shown in pandas-indexing.py.
+
+   Each strategy computes the same answer (total Fee of "Spark" courses plus the
+   number of "40days" durations) over generated frames shaped like the Technologys
+   frame in pandas-indexing.py, from 1e3 to 1e7 rows. Per strategy and size this
+   reports the best wall time of --repeat runs (time.perf_counter) and the peak
+   memory allocated during one extra run (tracemalloc), then writes a CSV table.
+
+   Slow strategies are skipped at sizes where the time measured at the previous
+   size, scaled by row count, would exceed --budget-secs.
+
+   Usage:
+       python3 pandas-iteration-bench.py
+       python3 pandas-iteration-bench.py --sizes 1000,100000 --repeat 5 --output bench.csv
+"""
+
+import argparse
+import csv
+import gc
+import time
+import tracemalloc
+
+import numpy as np   # installed with pandas
+import pandas as pd  # after pip install pandas
+
+COURSES = ["Spark", "Spark", "PySpark", "Hadoop", "Python", "Pandas", "Oracle", "Java"]
+DURATIONS = ["15day", "30day", "40days", "35days", "40days", "60days", "50days", "55days"]
+DEFAULT_SIZES = "1000,10000,100000,1000000,10000000"
+DEFAULT_OUTPUT = "pandas-iteration-bench.csv"
+
+
+def make_frame(rows, seed=0):
+    """Return a frame with the Courses/Fee/Duration columns of pandas-indexing.py, `rows` long."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "Courses": np.array(COURSES, dtype=object)[rng.integers(0, len(COURSES), rows)],
+        "Fee": rng.integers(10000, 26001, rows),
+        "Duration": np.array(DURATIONS, dtype=object)[rng.integers(0, len(DURATIONS), rows)],
+    })
+
+
+# Each strategy returns (total Fee where Courses == "Spark", count of Duration == "40days").
+
+def by_iterrows(df):
+    fee_total, count = 0, 0
+    for index, row in df.iterrows():
+        if row["Courses"] == "Spark":
+            fee_total += row["Fee"]
+        if row["Duration"] == "40days":
+            count += 1
+    return int(fee_total), count
+
+
+def by_itertuples(df):
+    fee_total, count = 0, 0
+    for row in df.itertuples(index=True):
+        if row.Courses == "Spark":
+            fee_total += row.Fee
+        if row.Duration == "40days":
+            count += 1
+    return int(fee_total), count
+
+
+def by_apply(df):
+    spark_fees = df.apply(lambda row: row["Fee"] if row["Courses"] == "Spark" else 0, axis=1)
+    forty_days = df.apply(lambda row: row["Duration"] == "40days", axis=1)
+    return int(spark_fees.sum()), int(forty_days.sum())
+
+
+def by_index_loop(df):
+    fee_total, count = 0, 0
+    for idx in df.index:
+        if df["Courses"][idx] == "Spark":
+            fee_total += df["Fee"][idx]
+        if df["Duration"][idx] == "40days":
+            count += 1
+    return int(fee_total), count
+
+
+def by_loc(df):
+    fee_total, count = 0, 0
+    for i in range(len(df)):
+        if df.loc[i, "Courses"] == "Spark":
+            fee_total += df.loc[i, "Fee"]
+        if df.loc[i, "Duration"] == "40days":
+            count += 1
+    return int(fee_total), count
+
+
+def by_iloc(df):
+    fee_total, count = 0, 0
+    courses, fee, duration = (df.columns.get_loc(name) for name in ("Courses", "Fee", "Duration"))
+    for i in range(len(df)):
+        if df.iloc[i, courses] == "Spark":
+            fee_total += df.iloc[i, fee]
+        if df.iloc[i, duration] == "40days":
+            count += 1
+    return int(fee_total), count
+
+
+def by_items(df):
+    """Column-wise, as in the df.items() example: iterate columns, then values of each."""
+    columns = dict(df.items())
+    fee_total, count = 0, 0
+    for course, fee in zip(columns["Courses"], columns["Fee"]):
+        if course == "Spark":
+            fee_total += fee
+    for duration in columns["Duration"]:
+        if duration == "40days":
+            count += 1
+    return int(fee_total), count
+
+
+def by_numpy_zip(df):
+    fee_total, count = 0, 0
+    for course, fee, duration in zip(df["Courses"].to_numpy(), df["Fee"].to_numpy().tolist(),
+                                     df["Duration"].to_numpy()):
+        if course == "Spark":
+            fee_total += fee
+        if duration == "40days":
+            count += 1
+    return int(fee_total), count
+
+
+def by_vectorized(df):
+    return int(df.loc[df["Courses"] == "Spark", "Fee"].sum()), int((df["Duration"] == "40days").sum())
+
+
+# In the order pandas-indexing.py shows them, then the two faster variants:
+STRATEGIES = {
+    "iterrows": by_iterrows,
+    "itertuples": by_itertuples,
+    "apply": by_apply,
+    "index_loop": by_index_loop,
+    "loc": by_loc,
+    "iloc": by_iloc,
+    "items": by_items,
+    "to_numpy_zip": by_numpy_zip,
+    "vectorized": by_vectorized,
+}
+
+
+def time_strategy(func, df, repeat):
+    """Return (best seconds of `repeat` runs, result of the last run)."""
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func(df)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def peak_memory(func, df):
+    """Return the peak bytes allocated while func(df) runs, beyond what df already holds."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        func(df)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmarks(sizes, strategies, repeat=3, budget_secs=30.0, seed=0, progress=print):
+    """Return one result dict per (size, strategy), smallest sizes first."""
+    results = []
+    last_secs_per_row = {}
+    for rows in sizes:
+        df = make_frame(rows, seed)
+        expected = by_vectorized(df)
+        for name in strategies:
+            func = STRATEGIES[name]
+            result = {"strategy": name, "rows": rows, "seconds": "", "rows_per_sec": "",
+                      "peak_mib": "", "status": "ok"}
+            projected = last_secs_per_row.get(name, 0.0) * rows * (repeat + 1)
+            if projected > budget_secs:
+                result["status"] = "skipped (projected %.0fs)" % projected
+            else:
+                seconds, answer = time_strategy(func, df, repeat)
+                last_secs_per_row[name] = seconds / rows
+                result["seconds"] = "%.6f" % seconds
+                result["rows_per_sec"] = "%.0f" % (rows / seconds) if seconds else ""
+                result["peak_mib"] = "%.3f" % (peak_memory(func, df) / 1024 / 1024)
+                if answer != expected:
+                    result["status"] = "WRONG %s != %s" % (answer, expected)
+            results.append(result)
+            if progress:
+                progress("%9d rows  %-13s %10s s  %10s MiB  %s" % (
+                    rows, name, result["seconds"], result["peak_mib"], result["status"]))
+        del df
+    return results
+
+
+def write_results(results, output_file):
+    fieldnames = ["strategy", "rows", "seconds", "rows_per_sec", "peak_mib", "status"]
+    with open(output_file, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark pandas DataFrame row-iteration strategies.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma-separated row counts")
+    parser.add_argument("--strategies", default=",".join(STRATEGIES), help="comma-separated subset of: " + ",".join(STRATEGIES))
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per strategy and size (best is kept)")
+    parser.add_argument("--budget-secs", type=float, default=30.0, help="skip a strategy at sizes projected to take longer")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="CSV results table")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(float(size)) for size in args.sizes.split(",")]
+    strategies = [name.strip() for name in args.strategies.split(",")]
+    unknown = [name for name in strategies if name not in STRATEGIES]
+    if unknown:
+        raise SystemExit("Unknown strategies: " + ", ".join(unknown))
+    print("*** pandas %s, numpy %s, repeat=%d, budget=%.0fs" % (pd.__version__, np.__version__, args.repeat, args.budget_secs))
+    results = run_benchmarks(sizes, strategies, args.repeat, args.budget_secs, args.seed)
+    write_results(results, args.output)
+    print("*** Results written to " + args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# snapshot_cache.py in https://github.com/wilsonmar/python-samples/blob/main/snapshot_cache.py
+"""Typed binary snapshots of CSV/XLSX source files, so repeat runs skip text parsing.
+
+   The first read of a source file parses it with pandas as usual, then saves the
+   resulting DataFrame (including its index) as an uncompressed Feather file
+   (Arrow IPC) under a .snapshots folder next to the source. Later reads load the
+   snapshot through a memory map instead of re-parsing the text.
+
+   When pyarrow is not installed, a bundle of NumPy .npy files (one per column)
+   is written instead; numeric columns in that bundle are memory-mapped too.
+
+   A snapshot is reused while the source's size and mtime match what was recorded.
+   If those differ (touch, git checkout), the SHA-256 of the source is compared
+   before anything is re-parsed, so only a real content change rebuilds the snapshot.
+
+   Usage:
+       import snapshot_cache
+       df = snapshot_cache.read_csv_snapshot("nba-2.csv", index_col="Name")
+       df = snapshot_cache.read_excel_snapshot("country_lang_info.xlsx", sheet_name="locale_datetime")
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np   # installed with pandas
+import pandas as pd  # after pip install pandas
+
+try:
+    import pyarrow as pa           # after pip install pyarrow
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+    feather = None
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR_NAME = ".snapshots"
+# Bump when the layout of snapshots or their .json metadata changes:
+SNAPSHOT_VERSION = 1
+HASH_BUF_SIZE = 1024 * 1024
+
+
+def source_sha256(source_path, buf_size=HASH_BUF_SIZE):
+    """Return the SHA-256 hex digest of the source file's bytes."""
+    hasher = hashlib.sha256()
+    with open(source_path, "rb") as f:
+        while chunk := f.read(buf_size):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def snapshot_base_path(source_path, reader_name, reader_kwargs, snapshot_dir=None):
+    """Return the snapshot path (without suffix) for a source read with these options.
+       The same file read with different options (encoding, index_col, sheet) gets its own snapshot.
+    """
+    source_path = os.path.abspath(source_path)
+    if not snapshot_dir:
+        snapshot_dir = os.path.join(os.path.dirname(source_path), SNAPSHOT_DIR_NAME)
+    options = repr((reader_name, sorted(reader_kwargs.items())))
+    options_digest = hashlib.sha256(options.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(snapshot_dir, os.path.basename(source_path) + "." + options_digest)
+
+
+def read_snapshot_meta(meta_path):
+    """Return the metadata dict saved with a snapshot, or None if missing or unreadable."""
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get("version") != SNAPSHOT_VERSION:
+        return None
+    return meta
+
+
+def write_snapshot_meta(meta_path, meta):
+    """Write metadata atomically. It is written last, so its presence marks a complete snapshot."""
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, meta_path)
+
+
+def write_feather_snapshot(df, data_path):
+    """Save df (with its index) as uncompressed Feather V2, which can be memory-mapped."""
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    tmp_path = data_path + ".tmp"
+    feather.write_feather(table, tmp_path, compression="uncompressed")
+    os.replace(tmp_path, data_path)
+
+
+def read_feather_snapshot(data_path):
+    """Load a Feather snapshot through a memory map."""
+    table = feather.read_table(data_path, memory_map=True)
+    return table.to_pandas()
+
+
+def write_npy_snapshot(df, data_path):
+    """Save df as a folder of .npy files, one per column plus one per index level.
+       Column order, names and index names go in columns.json inside the folder.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix=os.path.basename(data_path) + ".", dir=os.path.dirname(data_path))
+    flat = df.reset_index()
+    index_names = [str(name) for name in flat.columns[:df.index.nlevels]]
+    layout = {"columns": [], "index": index_names,
+              "index_is_default": [name is None for name in df.index.names]}
+    for position, name in enumerate(flat.columns):
+        values = flat.iloc[:, position].to_numpy()
+        file_name = "%04d.npy" % position
+        np.save(os.path.join(tmp_dir, file_name), values, allow_pickle=(values.dtype == object))
+        layout["columns"].append({"name": str(name), "file": file_name})
+    with open(os.path.join(tmp_dir, "columns.json"), "w", encoding="utf-8") as f:
+        json.dump(layout, f)
+    if os.path.isdir(data_path):
+        shutil.rmtree(data_path)
+    os.replace(tmp_dir, data_path)
+
+
+def read_npy_snapshot(data_path):
+    """Load a .npy folder snapshot. Numeric columns are memory-mapped read-only;
+       object (string) columns are unpickled, since pickled arrays cannot be mapped.
+    """
+    with open(os.path.join(data_path, "columns.json"), "r", encoding="utf-8") as f:
+        layout = json.load(f)
+    data = {}
+    for column in layout["columns"]:
+        file_path = os.path.join(data_path, column["file"])
+        try:
+            # np.asarray drops the memmap subclass but still shares the mapped pages:
+            data[column["name"]] = np.asarray(np.load(file_path, mmap_mode="r"))
+        except ValueError:   # object arrays are pickled and can't be memory-mapped.
+            data[column["name"]] = np.load(file_path, allow_pickle=True)
+    df = pd.DataFrame(data, copy=False)
+    if layout["index"]:
+        df = df.set_index(layout["index"])
+        df.index.names = [None if is_default else name
+                          for name, is_default in zip(layout["index"], layout["index_is_default"])]
+    return df
+
+
+def snapshot_format():
+    """Return the snapshot format used in this environment."""
+    return "feather" if feather is not None else "npy"
+
+
+def load_snapshot(source_path, reader, reader_kwargs, snapshot_dir=None):
+    """Return the DataFrame reader(source_path, **reader_kwargs) would, from a snapshot when valid.
+       The snapshot is (re)built whenever the source's SHA-256 differs from the recorded one.
+    """
+    stat = os.stat(source_path)
+    base_path = snapshot_base_path(source_path, reader.__name__, reader_kwargs, snapshot_dir)
+    meta_path = base_path + ".json"
+    fmt = snapshot_format()
+    data_path = base_path + "." + fmt
+    read_snapshot = read_feather_snapshot if fmt == "feather" else read_npy_snapshot
+
+    meta = read_snapshot_meta(meta_path)
+    if meta and meta.get("format") == fmt and os.path.exists(data_path):
+        if meta["size"] == stat.st_size and meta["mtime_ns"] == stat.st_mtime_ns:
+            logger.debug("snapshot hit (stat) %s", data_path)
+            return read_snapshot(data_path)
+        source_digest = source_sha256(source_path)
+        if meta["sha256"] == source_digest:
+            # Same bytes with a new mtime: record the new stat so the next run skips hashing.
+            meta["size"], meta["mtime_ns"] = stat.st_size, stat.st_mtime_ns
+            write_snapshot_meta(meta_path, meta)
+            logger.debug("snapshot hit (sha256) %s", data_path)
+            return read_snapshot(data_path)
+    else:
+        source_digest = source_sha256(source_path)
+
+    logger.debug("snapshot miss, parsing %s", source_path)
+    df = reader(source_path, **reader_kwargs)
+    os.makedirs(os.path.dirname(base_path), exist_ok=True)
+    if os.path.exists(meta_path):   # so a half-written rebuild is never taken as valid.
+        os.remove(meta_path)
+    if fmt == "feather":
+        write_feather_snapshot(df, data_path)
+    else:
+        write_npy_snapshot(df, data_path)
+    write_snapshot_meta(meta_path, {
+        "version": SNAPSHOT_VERSION,
+        "format": fmt,
+        "source": os.path.abspath(source_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": source_digest,
+        "rows": len(df.index),
+    })
+    return df
+
+
+def read_csv_snapshot(source_path, snapshot_dir=None, **read_csv_kwargs):
+    """Drop-in for pd.read_csv(source_path, **read_csv_kwargs) backed by a binary snapshot."""
+    return load_snapshot(source_path, pd.read_csv, read_csv_kwargs, snapshot_dir)
+
+
+def read_excel_snapshot(source_path, snapshot_dir=None, **read_excel_kwargs):
+    """Drop-in for pd.read_excel(source_path, **read_excel_kwargs) backed by a binary snapshot."""
+    return load_snapshot(source_path, pd.read_excel, read_excel_kwargs, snapshot_dir)